@@ -16,12 +16,21 @@
 
 from __future__ import absolute_import
 
+import threading
+
 from dogpile.cache import api
 import pylru
 
+_NUM_SHARDS = 16
+
 
 class LruBackend(api.CacheBackend):
-    """A dogpile.cache backend that uses LRU as the size management."""
+    """A dogpile.cache backend that uses LRU as the size management.
+
+    When the capacity allows it, entries are spread over several LRU shards,
+    each guarded by its own lock, so that concurrent requests seldom contend
+    on the same lock.  LRU order is then maintained per shard.
+    """
 
     def __init__(self, options):
         """Initializes an LruBackend.
@@ -30,13 +39,31 @@ class LruBackend(api.CacheBackend):
           options: a dictionary that contains configuration options.
         """
         capacity = options[u"capacity"] if u"capacity" in options else 200
-        self._cache = pylru.lrucache(capacity)
+        num_shards = _NUM_SHARDS if capacity >= _NUM_SHARDS else 1
+        # Spread the remainder over the first shards so that the total
+        # capacity is the configured one.
+        shard_capacity, remainder = divmod(capacity, num_shards)
+        self._shards = [
+            (threading.Lock(), pylru.lrucache(shard_capacity + (i < remainder)))
+            for i in range(num_shards)]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
 
     def get(self, key):
-        return self._cache[key] if key in self._cache else api.NO_VALUE
+        lock, shard = self._shard(key)
+        with lock:
+            try:
+                return shard[key]
+            except KeyError:
+                return api.NO_VALUE
 
     def set(self, key, value):
-        self._cache[key] = value
+        lock, shard = self._shard(key)
+        with lock:
+            shard[key] = value
 
     def delete(self, key):
-        del self._cache[key]
+        lock, shard = self._shard(key)
+        with lock:
+            del shard[key]
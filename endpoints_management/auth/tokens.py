@@ -17,6 +17,7 @@
 from __future__ import absolute_import
 
 import datetime
+import hashlib
 import jwkest
 import time
 
@@ -44,6 +45,7 @@ class Authenticator(object):  # pylint: disable=too-few-public-methods
         """
         self._issuers_to_provider_ids = issuers_to_provider_ids
         self._jwks_supplier = jwks_supplier
+        self._jwks_indexes = {}
 
         arguments = {u"capacity": cache_capacity}
         expiration_time = datetime.timedelta(minutes=5)
@@ -120,19 +122,52 @@ class Authenticator(object):  # pylint: disable=too-few-public-methods
         """
 
         def _decode_and_verify():
-            jwt_claims = jwt.JWT().unpack(auth_token).payload()
+            unpacked = jwt.JWT().unpack(auth_token)
+            jwt_claims = unpacked.payload()
             _verify_required_claims_exist(jwt_claims)
 
             issuer = jwt_claims[u"iss"]
-            keys = self._jwks_supplier.supply(issuer)
+            kid = unpacked.headers.get(u"kid")
+            keys = self._get_verification_keys(issuer, kid)
             try:
+                if kid and not keys:
+                    raise jws.NoSuitableSigningKeys(u"No key with kid: %s" % kid)
                 return jws.JWS().verify_compact(auth_token, keys)
             except (jwkest.BadSignature, jws.NoSuitableSigningKeys,
                     jws.SignerAlgError) as exception:
                 raise suppliers.UnauthenticatedException(u"Signature verification failed",
                                                          exception)
 
-        return self._cache.get_or_create(auth_token, _decode_and_verify)
+        return self._cache.get_or_create(_cache_key(auth_token), _decode_and_verify)
+
+    def _get_verification_keys(self, issuer, kid):
+        """Returns the keys of an issuer that may verify a token's signature.
+
+        The JWKS supplied for an issuer is indexed by key id the first time it
+        is seen, and the index is reused for as long as the supplier returns
+        the same JWKS, so a token with a "kid" header is matched without
+        scanning every key.
+
+        Args:
+          issuer: the issuer of the token.
+          kid: the "kid" header of the token, if any.
+
+        Returns:
+          The candidate keys; all of the issuer's keys when there is no kid.
+        """
+        keys = self._jwks_supplier.supply(issuer)
+        if not kid or keys is None:
+            return keys
+        if not isinstance(kid, basestring):
+            return []
+
+        indexed_keys, keys_by_kid = self._jwks_indexes.get(issuer, (None, None))
+        if indexed_keys is not keys:
+            keys_by_kid = {}
+            for key in keys:
+                keys_by_kid.setdefault(key.kid, []).append(key)
+            self._jwks_indexes[issuer] = (keys, keys_by_kid)
+        return keys_by_kid.get(kid, [])
 
 
 class UserInfo(object):
@@ -166,6 +201,28 @@ class UserInfo(object):
         return self._issuer
 
 
+def _cache_key(auth_token):
+    """Computes the key under which the claims of an auth token are cached.
+
+    The key is a SHA-256 digest of the whole token, which keeps entries small
+    and keeps the bearer tokens themselves out of the cache.  Hashing only the
+    signature segment is not enough, as a token with a tampered header or
+    payload but a reused signature would then hit the original's entry.
+
+    Hashing makes every lookup slower, cache hits included; that is the price
+    of not keeping raw bearer tokens in memory.
+
+    Args:
+      auth_token: the auth token.
+
+    Returns:
+      The cache key, as a byte string.
+    """
+    if isinstance(auth_token, unicode):
+        auth_token = auth_token.encode(u"utf-8")
+    return hashlib.sha256(auth_token).digest()
+
+
 def _check_jwt_claims(jwt_claims):
     """Checks whether the JWT claims should be accepted.
 
@@ -34,8 +34,10 @@ from __future__ import absolute_import
 # warning here.
 
 import collections
+import heapq
 import logging
 import threading
+import time as _time
 from datetime import datetime, timedelta
 
 import cachetools
@@ -161,9 +163,12 @@ class ReportOptions(
 
 
 ZERO_INTERVAL = timedelta()
+_EPOCH = datetime(1970, 1, 1)
 
+TINYLFU_ADMISSION = u'tinylfu'
 
-def create(options, timer=None, use_deque=True):
+
+def create(options, timer=None, use_deque=True, admission=None):
     """Create a cache specified by ``options``
 
     ``options`` is an instance of either
@@ -181,13 +186,16 @@ def create(options, timer=None, use_deque=True):
 
     Args:
       options (object): an instance of either of the options classes
+      admission (str): if :data:`TINYLFU_ADMISSION`, the LRU cache created
+        when ``options.flush_interval`` is not positive is a
+        :class:`TinyLFUCache`; it has no effect on TTL caches
 
     Returns:
       :class:`cachetools.Cache`: the cache implementation specified by options
         or None: if options is ``None`` or if options.num_entries < 0
 
     Raises:
-       ValueError: if options is not a support type
+       ValueError: if options or admission is not a support type
 
     """
     if options is None:  # no options, don't create cache
@@ -197,6 +205,10 @@ def create(options, timer=None, use_deque=True):
         _logger.error(u'make_cache(): bad options %s', options)
         raise ValueError(u'Invalid options')
 
+    if admission not in (None, TINYLFU_ADMISSION):
+        _logger.error(u'make_cache(): bad admission %s', admission)
+        raise ValueError(u'Invalid admission')
+
     if (options.num_entries <= 0):
         _logger.debug(u"did not create cache, options was %s", options)
         return None
@@ -215,10 +227,17 @@ def create(options, timer=None, use_deque=True):
                 timer=to_cache_timer(timer)
             ))
 
-    cache_cls = DequeOutLRUCache if use_deque else cachetools.LRUCache
+    if admission == TINYLFU_ADMISSION:
+        cache_cls = TinyLFUCache
+    else:
+        cache_cls = DequeOutLRUCache if use_deque else cachetools.LRUCache
     return LockedObject(cache_cls(options.num_entries))
 
 
+# The DequeOut caches hand removed items to an unbounded collections.deque.
+# CPython deques store items in fixed-size blocks, so an append does not
+# allocate per item; a bounded ring buffer would save little, and would have
+# to drop pending aggregated requests whenever it filled up between flushes.
 class DequeOutTTLCache(cachetools.TTLCache):
     """Extends ``TTLCache`` so that expired items are placed in a ``deque``."""
 
@@ -243,20 +262,75 @@ class DequeOutTTLCache(cachetools.TTLCache):
         elif not isinstance(out_deque, collections.deque):
             raise ValueError(u'out_deque should be a collections.deque')
         self._out_deque = out_deque
-        self._tracking = {}
+        # Expiry is tracked in buckets of one second, each holding
+        # ``(expiry, key)`` pairs in insertion order; ``_bucket_heap`` gives
+        # the earliest live bucket, so expire() only visits expired items.
+        self._entries = {}
+        self._buckets = collections.defaultdict(collections.deque)
+        self._bucket_heap = []
 
     def __setitem__(self, key, value, **kw):
-        super(DequeOutTTLCache, self).__setitem__(key, value, **kw)
-        self._tracking[key] = value
+        # Since cachetools 2.0 (the minimum required), TTLCache's timer is
+        # nestable: within this block it keeps returning now, so the tracked
+        # expiry is exactly the one TTLCache gives the item
+        with self.timer as now:
+            super(DequeOutTTLCache, self).__setitem__(key, value, **kw)
+        expiry = now + self.ttl
+        bucket = int(expiry)
+        if bucket not in self._buckets:
+            heapq.heappush(self._bucket_heap, bucket)
+        self._buckets[bucket].append((expiry, key))
+        self._entries[key] = (expiry, value)
+
+    def __delitem__(self, key, **kw):
+        # Evictions via popitem, pop, del or clear go through here; expired
+        # items are removed by expire(), which drains the expiry buckets.
+        value = cachetools.Cache.__getitem__(self, key)
+        del self._entries[key]
+        try:
+            super(DequeOutTTLCache, self).__delitem__(key, **kw)
+        finally:
+            # TTLCache raises KeyError after removing an item that had already
+            # expired; it has still left the cache, so it is still handed out
+            self._out_deque.append(value)
+
+    def expire(self, time=None):
+        """Remove expired items from the cache, adding them to the deque."""
+        if time is None:
+            time = self.timer()
+        super(DequeOutTTLCache, self).expire(time)
+        buckets = self._buckets
+        heap = self._bucket_heap
+        entries = self._entries
+        while heap and heap[0] < time:
+            bucket = buckets[heap[0]]
+            while bucket:
+                expiry, key = bucket[0]
+                entry = entries.get(key)
+                if entry is not None and entry[0] == expiry:
+                    if cachetools.Cache.__contains__(self, key):
+                        return  # this and all later entries are still live
+                    del entries[key]
+                    self._out_deque.append(entry[1])
+                bucket.popleft()
+            del buckets[heapq.heappop(heap)]
+
+    def keys_snapshot(self):
+        """Returns the keys held by the cache without checking their expiry.
+
+        Unlike iterating over the cache, this does not compare each item with
+        the timer, so it also includes items that have expired but that have
+        not yet been removed by :meth:`expire`.
+
+        Returns:
+          tuple: the keys held by the cache
+        """
+        return tuple(cachetools.Cache.__iter__(self))
 
     @property
     def out_deque(self):
         """The :class:`collections.deque` to which expired items are added."""
         self.expire()
-        expired = {k: v for (k, v) in self._tracking.items() if self.get(k) is None}
-        for k, v in expired.items():
-            del self._tracking[k]
-            self._out_deque.append(v)
         return self._out_deque
 
 
@@ -283,22 +357,132 @@ class DequeOutLRUCache(cachetools.LRUCache):
         elif not isinstance(out_deque, collections.deque):
             raise ValueError(u'out_deque should be collections.deque')
         self._out_deque = out_deque
-        self._tracking = {}
 
-    def __setitem__(self, key, value, **kw):
-        super(DequeOutLRUCache, self).__setitem__(key, value, **kw)
-        self._tracking[key] = value
+    def __delitem__(self, key, **kw):
+        # Every removal (eviction via popitem, pop, del or clear) goes through
+        # here, so the removed value is moved to the deque in constant time.
+        # Cache.__getitem__ is used to read the value without promoting it.
+        value = cachetools.Cache.__getitem__(self, key)
+        super(DequeOutLRUCache, self).__delitem__(key, **kw)
+        self._out_deque.append(value)
 
     @property
     def out_deque(self):
         """The :class:`collections.deque` to which expired items are added."""
-        expired = {k: v for (k, v) in self._tracking.items() if self.get(k) is None}
-        for k, v in expired.items():
-            del self._tracking[k]
-            self._out_deque.append(v)
         return self._out_deque
 
 
+class TinyLFUCache(DequeOutLRUCache):
+    """Extends ``DequeOutLRUCache`` with TinyLFU admission.
+
+    Once the cache is full, a new key is only admitted if it has recently been
+    used more often than the least recently used entry it would replace;
+    otherwise the new item is placed in the ``deque`` straight away, as if it
+    had been evicted immediately.  This stops a scan of keys that are used
+    once from evicting the entries that are used repeatedly.
+
+    Items are counted one each, so ``getsizeof`` is rejected.
+    """
+
+    def __init__(self, maxsize, out_deque=None, **kw):
+        """Constructor.
+
+        Args:
+          maxsize (int): the maximum number of entries in the queue
+          out_deque :class:`collections.deque`: a `deque` in which to add items
+            that expire from the cache or that are not admitted to it
+          **kw: the other keyword args supported by constructor to
+            :class:`cachetools.LRUCache`
+
+        Raises:
+          ValueError: if out_deque is not a collections.deque, or if
+            getsizeof is given
+
+        """
+        if kw.get('getsizeof') is not None:
+            raise ValueError(u'getsizeof is not supported')
+        super(TinyLFUCache, self).__init__(maxsize, out_deque=out_deque, **kw)
+        self._sketch = _FrequencySketch(10 * maxsize)
+        # mirrors the recency order of LRUCache, which keeps it private
+        self._recency = collections.OrderedDict()
+
+    def __getitem__(self, key, **kw):
+        value = super(TinyLFUCache, self).__getitem__(key, **kw)
+        self._sketch.increment(key)
+        self._recency[key] = self._recency.pop(key)
+        return value
+
+    def __setitem__(self, key, value, **kw):
+        self._sketch.increment(key)
+        if key in self._recency:
+            self._recency[key] = self._recency.pop(key)
+        elif self._recency and len(self._recency) >= self.maxsize:
+            victim = next(iter(self._recency))
+            if self._sketch.estimate(key) <= self._sketch.estimate(victim):
+                self._out_deque.append(value)
+                return
+            self._recency[key] = None
+        else:
+            self._recency[key] = None
+        super(TinyLFUCache, self).__setitem__(key, value, **kw)
+
+    def __delitem__(self, key, **kw):
+        super(TinyLFUCache, self).__delitem__(key, **kw)
+        del self._recency[key]
+
+    def popitem(self):
+        """Remove and return the `(key, value)` pair least recently used."""
+        try:
+            key = next(iter(self._recency))
+        except StopIteration:
+            raise KeyError(u'%s is empty' % self.__class__.__name__)
+        value = cachetools.Cache.__getitem__(self, key)
+        del self[key]
+        return (key, value)
+
+
+class _FrequencySketch(object):  # pylint: disable=too-few-public-methods
+    """Estimates how often keys have recently been seen.
+
+    This is a count-min sketch of 4-bit counters.  Once ``width`` increments
+    have been recorded, all the counters are halved, so that the estimates
+    follow changes in popularity.
+    """
+    _SEEDS = (0x5bd1e995, 0x1b873593)
+    _MAX_COUNT = 15
+
+    def __init__(self, width):
+        self._width = max(width, 1)
+        self._rows = [[0] * self._width for _ in self._SEEDS]
+        self._additions = 0
+
+    def _indexes(self, key):
+        width = self._width
+        return [hash((seed, key)) % width for seed in self._SEEDS]
+
+    def increment(self, key):
+        """Records that key has been seen."""
+        added = False
+        for row, index in zip(self._rows, self._indexes(key)):
+            if row[index] < self._MAX_COUNT:
+                row[index] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self._width:
+                self._halve()
+
+    def estimate(self, key):
+        """Returns an upper bound of the recent count of key."""
+        return min(row[index]
+                   for row, index in zip(self._rows, self._indexes(key)))
+
+    def _halve(self):
+        for row in self._rows:
+            row[:] = [count >> 1 for count in row]
+        self._additions //= 2
+
+
 class LockedObject(object):
     """LockedObject protects an object with a re-entrant lock.
 
@@ -329,11 +513,13 @@ def to_cache_timer(datetime_func):
        time_func (callable[[timestamp]): a func that returns the timestamp
          from the epoch
     """
-    if datetime_func is None:
-        datetime_func = datetime.utcnow
+    if datetime_func is None or datetime_func == datetime.utcnow:
+        # time.time gives the same timestamp without building two datetimes and
+        # a timedelta on each call
+        return _time.time
 
     def _timer():
         """Return the timestamp since the epoch."""
-        return (datetime_func() - datetime(1970, 1, 1)).total_seconds()
+        return (datetime_func() - _EPOCH).total_seconds()
 
     return _timer
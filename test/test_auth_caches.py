@@ -0,0 +1,61 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from dogpile.cache import api
+
+from endpoints_management.auth import caches
+
+
+class LruBackendTest(unittest.TestCase):
+    # Large enough to be sharded, and not a multiple of the number of shards.
+    _capacity = 31
+
+    def setUp(self):
+        self._backend = caches.LruBackend({u"capacity": self._capacity})
+
+    def test_get_set_and_delete_across_shards(self):
+        # Few enough keys that no shard has to evict any of them.
+        backend = caches.LruBackend({u"capacity": 200})
+        keys = [u"key-%d" % i for i in range(16)]
+        self.assertGreater(len(set(id(backend._shard(key)) for key in keys)), 1)
+        for key in keys:
+            backend.set(key, key.upper())
+        for key in keys:
+            self.assertEqual(key.upper(), backend.get(key))
+
+        backend.delete(keys[0])
+        self.assertIs(api.NO_VALUE, backend.get(keys[0]))
+        self.assertEqual(keys[1].upper(), backend.get(keys[1]))
+
+    def test_get_returns_no_value_on_miss(self):
+        self.assertIs(api.NO_VALUE, self._backend.get(u"missing"))
+
+    def test_entries_are_capped_at_capacity(self):
+        keys = [u"key-%d" % i for i in range(20 * self._capacity)]
+        for key in keys:
+            self._backend.set(key, key)
+        cached = [key for key in keys
+                  if self._backend.get(key) is not api.NO_VALUE]
+        self.assertEqual(self._capacity, len(cached))
+
+    def test_small_capacity_is_not_sharded(self):
+        backend = caches.LruBackend({u"capacity": 2})
+        backend.set(u"a", 1)
+        backend.set(u"b", 2)
+        backend.set(u"c", 3)
+        self.assertIs(api.NO_VALUE, backend.get(u"a"))
+        self.assertEqual(2, backend.get(u"b"))
+        self.assertEqual(3, backend.get(u"c"))
@@ -16,10 +16,9 @@ from __future__ import absolute_import
 
 import collections
 import datetime
+import time
 import unittest2
 
-from expects import be, be_a, be_none, equal, expect, raise_error
-
 from endpoints_management.control import caches, report_request
 
 
@@ -30,17 +29,16 @@ class TestDequeOutLRUCache(unittest2.TestCase):
 
     def test_constructor_should_set_up_a_default_deque(self):
         c = caches.DequeOutLRUCache(_TEST_NUM_ENTRIES)
-        expect(c.out_deque).to(be_a(collections.deque))
+        self.assertIsInstance(c.out_deque, collections.deque)
 
     def test_constructor_should_fail_on_bad_deques(self):
-        testf = lambda: caches.DequeOutLRUCache(_TEST_NUM_ENTRIES,
-                                                out_deque=object())
-        expect(testf).to(raise_error(ValueError))
+        with self.assertRaises(ValueError):
+            caches.DequeOutLRUCache(_TEST_NUM_ENTRIES, out_deque=object())
 
     def test_constructor_should_accept_deques(self):
         a_deque = collections.deque()
         c = caches.DequeOutLRUCache(_TEST_NUM_ENTRIES, out_deque=a_deque)
-        expect(c.out_deque).to(be(a_deque))
+        self.assertIs(c.out_deque, a_deque)
 
     def test_lru(self):
         lru_limit = 2
@@ -48,14 +46,73 @@ class TestDequeOutLRUCache(unittest2.TestCase):
         cache[1] = 1
         cache[2] = 2
         cache[3] = 3
-        expect(len(cache)).to(equal(2))
-        expect(cache[2]).to(equal(2))
-        expect(cache[3]).to(equal(3))
-        expect(cache.get(1)).to(be_none)
-        expect(len(cache.out_deque)).to(be(1))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache[2], 2)
+        self.assertEqual(cache[3], 3)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache.out_deque), 1)
         cache[4] = 4
-        expect(cache.get(2)).to(be_none)
-        expect(len(cache.out_deque)).to(be(2))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(len(cache.out_deque), 2)
+
+    def test_removed_items_are_added_to_the_deque(self):
+        cache = caches.DequeOutLRUCache(_TEST_NUM_ENTRIES)
+        cache[1] = 1
+        cache[2] = 2
+        cache[3] = 3
+        del cache[1]
+        self.assertEqual(list(cache.out_deque), [1])
+        self.assertEqual(cache.pop(2), 2)
+        self.assertEqual(list(cache.out_deque), [1, 2])
+        cache.clear()
+        self.assertEqual(list(cache.out_deque), [1, 2, 3])
+
+
+class TestTinyLFUCache(unittest2.TestCase):
+
+    def test_should_be_a_deque_out_lru_cache(self):
+        c = caches.TinyLFUCache(_TEST_NUM_ENTRIES)
+        self.assertIsInstance(c, caches.DequeOutLRUCache)
+        self.assertIsInstance(c.out_deque, collections.deque)
+
+    def test_lru(self):
+        lru_limit = 2
+        cache = caches.TinyLFUCache(lru_limit)
+        cache[1] = 1
+        cache[2] = 2
+        self.assertEqual(cache[1], 1)
+        self.assertEqual(cache[1], 1)
+        self.assertEqual(cache[1], 1)
+        cache[3] = 3  # 3 is as popular as 2, so is not admitted
+        self.assertEqual(list(cache.out_deque), [3])
+        self.assertIsNone(cache.get(3))
+        cache[3] = 3  # 3 is now more popular than 2, so replaces it
+        self.assertEqual(list(cache.out_deque), [3, 2])
+        self.assertEqual(dict(cache), {1: 1, 3: 3})
+
+    def test_scans_should_not_evict_popular_entries(self):
+        cache = caches.TinyLFUCache(_TEST_NUM_ENTRIES)
+        for key in range(_TEST_NUM_ENTRIES):
+            cache[key] = key
+            for _ in range(3):
+                self.assertEqual(cache[key], key)
+        for key in range(_TEST_NUM_ENTRIES, 10 * _TEST_NUM_ENTRIES):
+            cache[key] = key
+        self.assertEqual(set(cache), set(range(_TEST_NUM_ENTRIES)))
+        self.assertEqual(len(cache.out_deque), 9 * _TEST_NUM_ENTRIES)
+
+    def test_removed_items_are_added_to_the_deque(self):
+        cache = caches.TinyLFUCache(_TEST_NUM_ENTRIES)
+        cache[1] = 1
+        cache[2] = 2
+        del cache[1]
+        self.assertEqual(cache.popitem(), (2, 2))
+        self.assertEqual(list(cache.out_deque), [1, 2])
+        self.assertEqual(len(cache), 0)
+
+    def test_should_fail_if_getsizeof_is_given(self):
+        self.assertRaises(ValueError, caches.TinyLFUCache,
+                          _TEST_NUM_ENTRIES, getsizeof=len)
 
 
 class _Timer(object):
@@ -82,17 +139,17 @@ class TestDequeOutTTLCache(unittest2.TestCase):
 
     def test_constructor_should_set_up_a_default_deque(self):
         c = caches.DequeOutTTLCache(_TEST_NUM_ENTRIES, _TEST_TTL)
-        expect(c.out_deque).to(be_a(collections.deque))
+        self.assertIsInstance(c.out_deque, collections.deque)
 
     def test_constructor_should_fail_on_bad_deques(self):
-        testf = lambda: caches.DequeOutTTLCache(_TEST_NUM_ENTRIES, _TEST_TTL,
-                                                out_deque=object())
-        expect(testf).to(raise_error(ValueError))
+        with self.assertRaises(ValueError):
+            caches.DequeOutTTLCache(_TEST_NUM_ENTRIES, _TEST_TTL,
+                                    out_deque=object())
 
     def test_constructor_should_accept_deques(self):
         a_deque = collections.deque()
         c = caches.DequeOutTTLCache(3, 3, out_deque=a_deque)
-        expect(c.out_deque).to(be(a_deque))
+        self.assertIs(c.out_deque, a_deque)
 
     def test_lru(self):
         lru_limit = 2
@@ -101,136 +158,184 @@ class TestDequeOutTTLCache(unittest2.TestCase):
         cache[1] = 1
         cache[2] = 2
         cache[3] = 3
-        expect(len(cache)).to(equal(2))
-        expect(cache[2]).to(equal(2))
-        expect(cache[3]).to(equal(3))
-        expect(cache.get(1)).to(be_none)
-        expect(len(cache.out_deque)).to(be(1))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache[2], 2)
+        self.assertEqual(cache[3], 3)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache.out_deque), 1)
         cache[4] = 4
-        expect(cache.get(2)).to(be_none)
-        expect(len(cache.out_deque)).to(be(2))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(len(cache.out_deque), 2)
 
     def test_ttl(self):
         cache = caches.DequeOutTTLCache(2, ttl=1, timer=_Timer())
-        expect(cache.timer()).to(equal(0))
-        expect(cache.ttl).to(equal(1))
+        self.assertEqual(cache.timer(), 0)
+        self.assertEqual(cache.ttl, 1)
 
         cache[1] = 1
-        expect(set(cache)).to(equal({1}))
-        expect(len(cache)).to(equal(1))
-        expect(cache[1]).to(equal(1))
+        self.assertEqual(dict(cache), {1: 1})
+        self.assertEqual(len(cache), 1)
 
         cache.timer.tick()
-        expect(set(cache)).to(equal({1}))
-        expect(len(cache)).to(equal(1))
-        expect(cache[1]).to(equal(1))
+        self.assertEqual(dict(cache), {1: 1})
+        self.assertEqual(len(cache), 1)
 
         cache[2] = 2
-        expect(set(cache)).to(equal({1, 2}))
-        expect(len(cache)).to(equal(2))
-        expect(cache[1]).to(equal(1))
-        expect(cache[2]).to(equal(2))
+        self.assertEqual(dict(cache), {1: 1, 2: 2})
+        self.assertEqual(len(cache), 2)
 
         cache.timer.tick()
-        expect(set(cache)).to(equal({2}))
-        expect(len(cache)).to(equal(1))
-        expect(cache[2]).to(equal(2))
-        expect(cache.get(1)).to(be_none)
+        self.assertEqual(dict(cache), {2: 2})
+        self.assertEqual(len(cache), 1)
+        self.assertIsNone(cache.get(1))
+
+    def test_expired_items_are_added_to_the_deque(self):
+        cache = caches.DequeOutTTLCache(3, ttl=1, timer=_Timer())
+        cache[1] = 1
+        cache[2] = 2
+        cache.timer.tick()
+        cache[2] = 22  # resets the expiry of 2
+        cache[3] = 3
+        self.assertEqual(list(cache.out_deque), [])
+
+        cache.timer.tick()
+        self.assertEqual(list(cache.out_deque), [1])
+
+        cache.timer.tick()
+        self.assertEqual(list(cache.out_deque), [1, 22, 3])
+        self.assertEqual(len(cache), 0)
+
+    def test_items_set_again_after_expiring_are_added_to_the_deque(self):
+        # each read of the timer returns a later time, so any expiry computed
+        # from a second read would be later than the one TTLCache uses
+        times = iter([0.0, 0.96, 0.97, 0.98, 0.99, 1.0])
+        cache = caches.DequeOutTTLCache(2, ttl=0.95, timer=lambda: next(times))
+        cache[u'k'] = u'v1'
+        cache[u'k'] = u'v2'
+        self.assertEqual(list(cache.out_deque), [u'v1'])
+
+    def test_keys_snapshot_should_include_unremoved_expired_items(self):
+        cache = caches.DequeOutTTLCache(2, ttl=1, timer=_Timer())
+        cache[1] = 1
+        cache.timer.tick()
+        cache[2] = 2
+        cache.timer.tick()
+        self.assertEqual(set(cache.keys_snapshot()), {1, 2})
+        self.assertEqual(set(cache), {2})
+        cache.expire()
+        self.assertEqual(set(cache.keys_snapshot()), {2})
 
 
 class _DateTimeTimer(object):
+    _EPOCH = datetime.datetime(1970, 1, 1)
+
     def __init__(self, auto=False):
         self.auto = auto
-        self.time = datetime.datetime(1970, 1, 1)
+        self.reset()
 
     def __call__(self):
         if self.auto:
             self.tick()
-        return self.time
+        return self._EPOCH + datetime.timedelta(seconds=self._ticks)
 
     def tick(self):
-        self.time += datetime.timedelta(seconds=1)
+        self._ticks += 1
+
+    def reset(self):
+        self._ticks = 0
 
 
 class TestCreate(unittest2.TestCase):
 
     def test_should_fail_if_bad_options_are_used(self):
-        should_fail = [
-            lambda: caches.create(object()),
-        ]
-        for testf in should_fail:
-            expect(testf).to(raise_error(ValueError))
+        with self.assertRaises(ValueError):
+            caches.create(object())
 
     def test_should_return_none_if_options_is_none(self):
-        expect(caches.create(None)).to(be_none)
+        self.assertIsNone(caches.create(None))
 
     def test_should_return_none_if_cache_size_not_positive(self):
-        should_be_none = [
-            lambda: caches.create(caches.CheckOptions(num_entries=0)),
-            lambda: caches.create(caches.CheckOptions(num_entries=-1)),
-            lambda: caches.create(caches.ReportOptions(num_entries=0)),
-            lambda: caches.create(caches.ReportOptions(num_entries=-1)),
-        ]
-        for testf in should_be_none:
-            expect(testf()).to(be_none)
+        for options_cls, num_entries in [(caches.CheckOptions, 0),
+                                         (caches.CheckOptions, -1),
+                                         (caches.ReportOptions, 0),
+                                         (caches.ReportOptions, -1)]:
+            with self.subTest(options_cls=options_cls, num_entries=num_entries):
+                self.assertIsNone(
+                    caches.create(options_cls(num_entries=num_entries)))
 
     def test_should_return_ttl_cache_if_flush_interval_is_positive(self):
         delta = datetime.timedelta(seconds=1)
-        should_be_ttl = [
-            lambda timer: caches.create(
-                caches.CheckOptions(num_entries=1, flush_interval=delta),
-                timer=timer
-            ),
-            lambda timer: caches.create(
-                caches.ReportOptions(num_entries=1, flush_interval=delta),
-                timer=timer
-            ),
-        ]
-        for testf in should_be_ttl:
-            timer = _DateTimeTimer()
-            sync_cache = testf(timer)
-            expect(sync_cache).to(be_a(caches.LockedObject))
-            with sync_cache as cache:
-                expect(cache).to(be_a(caches.DequeOutTTLCache))
-                expect(cache.timer()).to(equal(0))
-                cache[1] = 1
-                expect(set(cache)).to(equal({1}))
-                expect(cache.get(1)).to(equal(1))
-                timer.tick()
-                expect(cache.get(1)).to(equal(1))
-                timer.tick()
-                expect(cache.get(1)).to(be_none)
-
-            # Is still TTL without the custom timer
-            sync_cache = testf(None)
-            expect(sync_cache).to(be_a(caches.LockedObject))
-            with sync_cache as cache:
-                expect(cache).to(be_a(caches.DequeOutTTLCache))
+        timer = _DateTimeTimer()
+        for options_cls in [caches.CheckOptions, caches.ReportOptions]:
+            with self.subTest(options_cls=options_cls):
+                options = options_cls(num_entries=1, flush_interval=delta)
+                timer.reset()
+                sync_cache = caches.create(options, timer=timer)
+                self.assertIsInstance(sync_cache, caches.LockedObject)
+                with sync_cache as cache:
+                    self.assertIsInstance(cache, caches.DequeOutTTLCache)
+                    self.assertEqual(cache.timer(), 0)
+                    cache[1] = 1
+                    self.assertEqual(set(cache.keys_snapshot()), {1})
+                    self.assertEqual(cache.get(1), 1)
+                    timer.tick()
+                    self.assertEqual(cache.get(1), 1)
+                    timer.tick()
+                    self.assertIsNone(cache.get(1))
+
+                # Is still TTL without the custom timer
+                sync_cache = caches.create(options)
+                self.assertIsInstance(sync_cache, caches.LockedObject)
+                with sync_cache as cache:
+                    self.assertIsInstance(cache, caches.DequeOutTTLCache)
 
     def test_should_return_a_lru_cache_if_flush_interval_is_negative(self):
         delta = datetime.timedelta(seconds=-1)
-        should_be_ttl = [
-            lambda: caches.create(
-                caches.CheckOptions(num_entries=1, flush_interval=delta),
-            ),
-            lambda: caches.create(
-                caches.ReportOptions(num_entries=1, flush_interval=delta)),
-        ]
-        for testf in should_be_ttl:
-            sync_cache = testf()
-            expect(sync_cache).to(be_a(caches.LockedObject))
-            with sync_cache as cache:
-                expect(cache).to(be_a(caches.DequeOutLRUCache))
+        for options_cls in [caches.CheckOptions, caches.ReportOptions]:
+            with self.subTest(options_cls=options_cls):
+                sync_cache = caches.create(
+                    options_cls(num_entries=1, flush_interval=delta))
+                self.assertIsInstance(sync_cache, caches.LockedObject)
+                with sync_cache as cache:
+                    self.assertIsInstance(cache, caches.DequeOutLRUCache)
+
+    def test_should_return_a_tinylfu_cache_if_admission_is_tinylfu(self):
+        delta = datetime.timedelta(seconds=-1)
+        for options_cls in [caches.CheckOptions, caches.ReportOptions]:
+            with self.subTest(options_cls=options_cls):
+                sync_cache = caches.create(
+                    options_cls(num_entries=1, flush_interval=delta),
+                    admission=caches.TINYLFU_ADMISSION)
+                with sync_cache as cache:
+                    self.assertIsInstance(cache, caches.TinyLFUCache)
+
+    def test_should_fail_if_bad_admission_is_used(self):
+        with self.assertRaises(ValueError):
+            caches.create(caches.ReportOptions(), admission=u'unknown')
+
+
+class TestToCacheTimer(unittest2.TestCase):
+
+    def test_should_use_time_for_the_default_timer(self):
+        self.assertIs(caches.to_cache_timer(None), time.time)
+        self.assertIs(caches.to_cache_timer(datetime.datetime.utcnow), time.time)
+
+    def test_should_convert_custom_timers_to_timestamps(self):
+        timer = _DateTimeTimer()
+        cache_timer = caches.to_cache_timer(timer)
+        self.assertEqual(cache_timer(), 0)
+        timer.tick()
+        self.assertEqual(cache_timer(), 1)
 
 
 class TestReportOptions(unittest2.TestCase):
 
     def test_should_create_with_defaults(self):
         options = caches.ReportOptions()
-        expect(options.num_entries).to(equal(
-            caches.ReportOptions.DEFAULT_NUM_ENTRIES))
-        expect(options.flush_interval).to(equal(
-            caches.ReportOptions.DEFAULT_FLUSH_INTERVAL))
+        self.assertEqual(options.num_entries,
+                         caches.ReportOptions.DEFAULT_NUM_ENTRIES)
+        self.assertEqual(options.flush_interval,
+                         caches.ReportOptions.DEFAULT_FLUSH_INTERVAL)
 
 
 class TestCheckOptions(unittest2.TestCase):
@@ -239,18 +344,18 @@ class TestCheckOptions(unittest2.TestCase):
 
     def test_should_create_with_defaults(self):
         options = caches.CheckOptions()
-        expect(options.num_entries).to(equal(
-            caches.CheckOptions.DEFAULT_NUM_ENTRIES))
-        expect(options.flush_interval).to(equal(
-            caches.CheckOptions.DEFAULT_FLUSH_INTERVAL))
-        expect(options.expiration).to(equal(
-            caches.CheckOptions.DEFAULT_EXPIRATION))
+        self.assertEqual(options.num_entries,
+                         caches.CheckOptions.DEFAULT_NUM_ENTRIES)
+        self.assertEqual(options.flush_interval,
+                         caches.CheckOptions.DEFAULT_FLUSH_INTERVAL)
+        self.assertEqual(options.expiration,
+                         caches.CheckOptions.DEFAULT_EXPIRATION)
 
     def test_should_ignores_lower_expiration(self):
         wanted_expiration = (
             self.AN_INTERVAL + datetime.timedelta(milliseconds=1))
         options = caches.CheckOptions(flush_interval=self.AN_INTERVAL,
                                       expiration=self.A_LOWER_INTERVAL)
-        expect(options.flush_interval).to(equal(self.AN_INTERVAL))
-        expect(options.expiration).to(equal(wanted_expiration))
-        expect(options.expiration).not_to(equal(self.A_LOWER_INTERVAL))
+        self.assertEqual(options.flush_interval, self.AN_INTERVAL)
+        self.assertEqual(options.expiration, wanted_expiration)
+        self.assertNotEqual(options.expiration, self.A_LOWER_INTERVAL)